@@ -2,16 +2,16 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
-#   "numpy",
-#   "pandas",
 # ]
 # ///
 
 import os
 
-import duckdb
-import plotly.express as px
+import plotly.graph_objects as go
+from db import get_connection
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -20,31 +20,41 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(script_dir, '..', 'data', 'sessions.db')
 
 # Connect to the database
-con = duckdb.connect(db_path)
+con = get_connection(db_path)
 
-# SQL query to calculate the average number of sessions per player per day
+# Width of a histogram bin, in sessions per day
+BIN_WIDTH = 0.5
+
+# SQL query to calculate the average number of sessions per player per day:
+# total sessions divided by the number of distinct days the player had sessions on.
+# The averages are binned in the database, so only one row per bin is fetched
 query = """
-WITH daily_sessions AS (
+WITH player_sessions AS (
     SELECT
         player,
-        CAST(session_start AS DATE) AS session_date,
-        COUNT(*) AS session_count
+        COUNT(*) / COUNT(DISTINCT CAST(session_start AS DATE)) AS avg_sessions
     FROM sessions
-    GROUP BY player, CAST(session_start AS DATE)
+    GROUP BY player
 )
 SELECT
-    player,
-    AVG(session_count) AS avg_sessions
-FROM daily_sessions
-GROUP BY player;
+    floor(avg_sessions / $bin_width) * $bin_width AS bin_start,
+    COUNT(*) AS player_count
+FROM player_sessions
+GROUP BY bin_start
+ORDER BY bin_start;
 """
 
-# Execute the query and fetch the results into a pandas DataFrame
-df = con.execute(query).fetchdf()
+# Execute the query and fetch the results into a Polars DataFrame
+df = con.execute(query, {'bin_width': BIN_WIDTH}).pl()
 
 # Create the histogram
-fig = px.histogram(df, x='avg_sessions', title='Average Sessions per Player per Day')
+fig = go.Figure(
+    go.Bar(x=df['bin_start'] + BIN_WIDTH / 2, y=df['player_count'], width=BIN_WIDTH)
+)
+fig.update_layout(
+    title='Average Sessions per Player per Day',
+    xaxis_title='avg_sessions',
+    yaxis_title='count',
+    bargap=0,
+)
 fig.show()
-
-# Close the database connection
-con.close()
@@ -2,16 +2,16 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
-#   "numpy",
-#   "pandas",
 # ]
 # ///
 
 import os
 
-import duckdb
-import plotly.express as px
+import plotly.graph_objects as go
+from db import get_connection
 
 # Get the directory of the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -20,41 +20,57 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(script_dir, '..', 'data', 'sessions.db')
 
 # Connect to the database
-con = duckdb.connect(db_path)
+con = get_connection(db_path)
 
-# SQL query to calculate the average time between sessions for each player on the same day
+# Width of a histogram bin, in minutes
+BIN_WIDTH = 5
+
+# SQL query to calculate the average time between sessions for each player on the same day.
+# Sessions are partitioned by player and start day, so only same-day pairs reach the window.
+# The averages are binned in the database, so only one row per bin is fetched
 query = """
 WITH session_times AS (
     SELECT
         player,
         session_start,
-        LAG(session_end, 1) OVER (PARTITION BY player ORDER BY session_start) AS prev_session_end
+        LAG(session_end, 1) OVER (
+            PARTITION BY player, date_trunc('day', session_start) ORDER BY session_start
+        ) AS prev_session_end
     FROM sessions
 ),
 time_diffs AS (
     SELECT
         player,
-        (epoch(session_start) - epoch(prev_session_end)) / 60.0 AS time_diff_minutes
+        date_diff('second', prev_session_end, session_start) / 60.0 AS time_diff_minutes
     FROM session_times
-    WHERE prev_session_end IS NOT NULL AND DATE(session_start) = DATE(prev_session_end)
+    WHERE prev_session_end IS NOT NULL
+),
+player_gaps AS (
+    SELECT
+        player,
+        AVG(time_diff_minutes) AS avg_time_diff
+    FROM time_diffs
+    GROUP BY player
 )
 SELECT
-    player,
-    AVG(time_diff_minutes) AS avg_time_diff
-FROM time_diffs
-GROUP BY player;
+    floor(avg_time_diff / $bin_width) * $bin_width AS bin_start,
+    COUNT(*) AS player_count
+FROM player_gaps
+GROUP BY bin_start
+ORDER BY bin_start;
 """
 
-# Execute the query and fetch the results into a pandas DataFrame
-df = con.execute(query).fetchdf()
+# Execute the query and fetch the results into a Polars DataFrame
+df = con.execute(query, {'bin_width': BIN_WIDTH}).pl()
 
 # Create the histogram
-fig = px.histogram(
-    df,
-    x='avg_time_diff',
+fig = go.Figure(
+    go.Bar(x=df['bin_start'] + BIN_WIDTH / 2, y=df['player_count'], width=BIN_WIDTH)
+)
+fig.update_layout(
     title='Average Time Between Player Sessions on the Same Day (minutes)',
+    xaxis_title='avg_time_diff',
+    yaxis_title='count',
+    bargap=0,
 )
 fig.show()
-
-# Close the database connection
-con.close()
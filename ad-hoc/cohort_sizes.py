@@ -2,7 +2,8 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
-#   "pandas",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
 # ]
 # ///
@@ -10,22 +11,18 @@
 from pathlib import Path
 
 import duckdb
-import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def get_cohort_sizes(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+def get_cohort_sizes(con: duckdb.DuckDBPyConnection) -> pl.DataFrame:
     """Calculates the size of each yearly cohort."""
     query = """
         SELECT
-            strftime(regdate, '%Y') AS year,
+            year(regdate) AS year,
             COUNT(*) AS cohort_size
         FROM
             players
@@ -36,10 +33,10 @@ def get_cohort_sizes(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
         ORDER BY
             year;
     """
-    return con.execute(query).fetchdf()
+    return con.execute(query).pl()
 
 
-def plot_cohort_sizes(df: pd.DataFrame):
+def plot_cohort_sizes(df: pl.DataFrame):
     """Generates and displays a bar plot of cohort sizes."""
     fig = go.Figure()
     fig.add_trace(
@@ -60,12 +57,12 @@ def plot_cohort_sizes(df: pd.DataFrame):
 
 def main():
     """Main function to get, print, and plot cohort sizes."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
     cohort_sizes_df = get_cohort_sizes(con)
-    con.close()
 
     print('Yearly Cohort Sizes (Number of Registered Accounts):')
-    print(cohort_sizes_df.to_string(index=False))
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(cohort_sizes_df)
 
     plot_cohort_sizes(cohort_sizes_df)
 
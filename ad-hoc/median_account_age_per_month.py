@@ -2,26 +2,25 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
+#   "numpy",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
-#   "pandas",
 # ]
 # ///
 
 from pathlib import Path
 
 import duckdb
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def plot_data(df: pd.DataFrame, title: str, y_axis_title: str):
+def plot_data(df: pl.DataFrame, title: str, y_axis_title: str):
     """Generates and displays a line plot."""
     fig = go.Figure()
     fig.add_trace(
@@ -47,12 +46,14 @@ def plot_data(df: pd.DataFrame, title: str, y_axis_title: str):
 
     # Add annotations for specific ages
     annotation_ages = [1, 2, 3, 4]
+    periods = df['period'].to_numpy()
+    ages = df['avg_age_years'].to_numpy()
     for age in annotation_ages:
         # Find the period where the age is closest to the target age
-        closest_index = (df['avg_age_years'] - age).abs().idxmin()
+        closest_index = np.argmin(np.abs(ages - age))
         fig.add_annotation(
-            x=df['period'][closest_index],
-            y=df['avg_age_years'][closest_index],
+            x=periods[closest_index],
+            y=ages[closest_index],
             text=f'~{age} г.',
             showarrow=True,
             arrowhead=1,
@@ -64,156 +65,64 @@ def plot_data(df: pd.DataFrame, title: str, y_axis_title: str):
     fig.show()
 
 
-def get_data(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+def get_data(con: duckdb.DuckDBPyConnection) -> pl.DataFrame:
     """Calculates the average account age in years per month."""
 
     query = """
-
-
     WITH
-
-
-    -- Generate a series of months from the earliest registration date to the current date
-
-
-    months AS (
-
-
+    -- Month index of each qualifying player's registration, and the first period
+    -- whose end (the last day of the month, at midnight) is not before it
+    player_months AS (
         SELECT
-
-
-            CAST(date_trunc('month', dd.generate_series) AS date) AS period_start
-
-
-        FROM generate_series(
-
-
-            CAST((SELECT MIN(regdate) FROM players WHERE regdate >= '2018-01-01') AS TIMESTAMP WITH TIME ZONE),
-
-
-            now(),
-
-
-            interval '1 month'
-
-
-        ) AS dd
-
-
+            date_diff('month', DATE '2018-01-01', regdate) AS reg_month,
+            reg_month + (regdate > last_day(regdate))::INTEGER AS first_month
+        FROM players
+        WHERE regdate >= '2018-01-01'
+            AND last_activity > regdate + interval '1 month'
     ),
-
-
-    -- Define the period end for each month
-
-
-    periods AS (
-
-
-        SELECT
-
-
-            period_start,
-
-
-            period_start + interval '1 month' - interval '1 day' AS period_end
-
-
-        FROM months
-
-
+    -- Number of players entering each period and the sum of their registration months
+    entries AS (
+        SELECT first_month, COUNT(*) AS players, SUM(reg_month) AS reg_month_sum
+        FROM player_months
+        GROUP BY first_month
     ),
-
-
-    -- Calculate player activity and tenor
-
-
-    player_activity AS (
-
-
-        SELECT
-
-
-            p.id,
-
-
-            p.regdate,
-
-
-            COALESCE(p.lastlogin, p.regdate) AS last_activity
-
-
-        FROM players p
-
-
-        WHERE p.regdate >= '2018-01-01'
-
-
+    -- Generate a series of month indices from the earliest registration to the current month
+    months AS (
+        SELECT generate_series AS month
+        FROM generate_series(
+            (SELECT date_diff('month', DATE '2018-01-01', MIN(regdate)) FROM players WHERE regdate >= '2018-01-01'),
+            date_diff('month', DATE '2018-01-01', current_date)
+        )
     ),
-
-
-    -- Calculate age for each player for each period they were active in
-
-
-    player_ages AS (
-
-
+    -- The average age at month m is m minus the mean registration month of everyone counted so far
+    period_ages AS (
         SELECT
-
-
-            strftime(per.period_start, '%Y-%m') AS period,
-
-
-            date_diff('month', pa.regdate, per.period_end) AS account_age_months
-
-
-        FROM periods per
-
-
-        JOIN player_activity pa ON pa.regdate <= per.period_end
-
-
-        WHERE pa.last_activity > pa.regdate + interval '1 month'
-
-
+            CAST(DATE '2018-01-01' + to_months(m.month) AS DATE) AS period,
+            m.month - SUM(e.reg_month_sum) OVER w / SUM(e.players) OVER w AS avg_age_months
+        FROM months m
+        LEFT JOIN entries e ON e.first_month = m.month
+        WINDOW w AS (ORDER BY m.month)
     )
-
-
-    -- Main query to calculate average account age for each period
-
-
     SELECT
-
-
         period,
-
-
-        AVG(account_age_months) / 12.0 AS avg_age_years
-
-
-    FROM player_ages
-
-
-    GROUP BY period
-
-
+        avg_age_months / 12.0 AS avg_age_years
+    FROM period_ages
+    WHERE avg_age_months IS NOT NULL
     ORDER BY period;
-
-
     """
 
-    return con.execute(query).fetchdf()
+    return con.execute(query).pl()
 
 
 def main():
     """Main function to generate and display the plot."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
     df = get_data(con)
     plot_data(
         df,
         '<b>Медианный возраст активных аккаунтов<br>с течением времени</b>',
         'Медианный возраст',
     )
-    con.close()
 
 
 if __name__ == '__main__':
@@ -2,42 +2,38 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
-#   "pandas",
 # ]
 # ///
 
 from pathlib import Path
 
 import duckdb
-import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def plot_data(df: pd.DataFrame):
+def plot_data(df: pl.DataFrame):
     """Generates and displays a stacked area plot."""
-    fig = go.Figure()
-
-    cohorts = sorted(df['cohort_year'].unique())
-
-    for cohort in cohorts:
-        cohort_df = df[df['cohort_year'] == cohort]
-        fig.add_trace(
+    fig = go.Figure(
+        data=[
             go.Scatter(
                 x=cohort_df['period'],
                 y=cohort_df['player_count'],
-                name=cohort,
+                name=str(cohort),
                 stackgroup='one',
                 mode='lines',
             )
-        )
+            for (cohort,), cohort_df in sorted(
+                df.partition_by('cohort_year', as_dict=True).items()
+            )
+        ]
+    )
 
     fig.update_layout(
         title_text='<b>Распределение игроков по когортам с течением времени</b>',
@@ -49,62 +45,53 @@ def plot_data(df: pd.DataFrame):
     fig.show()
 
 
-def get_data(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+def get_data(con: duckdb.DuckDBPyConnection) -> pl.DataFrame:
     """Calculates the number of players per registration cohort for each month."""
     query = """
     WITH
-    -- Generate a series of months
-    months AS (
-        SELECT CAST(date_trunc('month', dd.generate_series) AS date) AS period_start
-        FROM generate_series(
-            CAST((SELECT MIN(regdate) FROM players WHERE regdate >= '2018-01-01') AS TIMESTAMP WITH TIME ZONE),
-            now(),
-            interval '1 month'
-        ) AS dd
-    ),
-    -- Define the period end for each month
-    periods AS (
-        SELECT
-            period_start,
-            period_start + interval '1 month' - interval '1 day' AS period_end
-        FROM months
-    ),
-    -- Get players with their registration year as cohort
-    players_with_cohort AS (
+    -- Month indices of the first and last period each player counts towards: the first
+    -- period whose end (the last day of the month, at midnight) is not before the
+    -- registration, and the month of the player's last activity
+    player_months AS (
         SELECT
-            id,
-            regdate,
-            COALESCE(lastlogin, regdate) AS last_activity,
-            strftime(regdate, '%Y') AS cohort_year
+            year(regdate) AS cohort_year,
+            date_diff('month', DATE '2018-01-01', regdate)
+                + (regdate > last_day(regdate))::INTEGER AS first_month,
+            date_diff('month', DATE '2018-01-01', last_activity) AS last_month
         FROM players
         WHERE regdate >= '2018-01-01'
+    ),
+    -- Expand each player into one row per month they were active in
+    player_periods AS (
+        SELECT
+            cohort_year,
+            unnest(generate_series(first_month, last_month)) AS month
+        FROM player_months
     )
-    -- Main query to count active players per cohort for each period
+    -- Main query to count active players per cohort for each period. Rows only need to be
+    -- in period order for the line traces, so sort by the integer month index alone
     SELECT
-        strftime(p.period_start, '%Y-%m') AS period,
-        pc.cohort_year,
-        COUNT(pc.id) AS player_count
-    FROM periods p
-    JOIN players_with_cohort pc
-        ON pc.regdate <= p.period_end AND pc.last_activity >= p.period_start
-    GROUP BY period, pc.cohort_year
-    ORDER BY period, pc.cohort_year;
+        strftime(DATE '2018-01-01' + to_months(month), '%Y-%m') AS period,
+        cohort_year,
+        COUNT(*) AS player_count
+    FROM player_periods
+    GROUP BY month, cohort_year
+    ORDER BY month;
     """
-    df = con.execute(query).fetchdf()
+    df = con.execute(query).pl()
 
-    if not df.empty:
+    if not df.is_empty():
         last_period = df['period'].max()
-        df = df[df['period'] != last_period]
+        df = df.filter(pl.col('period') != last_period)
 
     return df
 
 
 def main():
     """Main function to generate and display the plot."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
     df = get_data(con)
     plot_data(df)
-    con.close()
 
 
 if __name__ == '__main__':
@@ -2,7 +2,8 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
-#   "pandas",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
 # ]
 # ///
@@ -10,23 +11,21 @@
 from pathlib import Path
 
 import duckdb
-import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def get_name_segments(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+def get_name_segments(con: duckdb.DuckDBPyConnection) -> pl.DataFrame:
     """Segments players by name format (RP vs. non-RP)."""
     query = """
         SELECT
             CASE
-                WHEN regexp_matches(login, '^[A-Z][a-z]+_[A-Z][a-z]+$') THEN 'RP Names'
+                -- Cheap underscore position check first, so most logins skip the regex
+                WHEN strpos(login, '_') BETWEEN 3 AND length(login) - 2
+                    AND regexp_full_match(login, '[A-Z][a-z]+_[A-Z][a-z]+') THEN 'RP Names'
                 ELSE 'Not RP Names'
             END AS segment,
             COUNT(*) AS count
@@ -35,10 +34,10 @@ def get_name_segments(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
         GROUP BY
             segment;
     """
-    return con.execute(query).fetchdf()
+    return con.execute(query).pl()
 
 
-def plot_segments(df: pd.DataFrame):
+def plot_segments(df: pl.DataFrame):
     """Generates and displays a pie chart of the segments."""
     fig = go.Figure(data=[go.Pie(labels=df['segment'], values=df['count'], hole=0.3)])
     fig.update_layout(title_text='Player Name Segmentation (RP vs. Not RP)')
@@ -47,12 +46,12 @@ def plot_segments(df: pd.DataFrame):
 
 def main():
     """Main function to get, print, and plot name segments."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
     segments_df = get_name_segments(con)
-    con.close()
 
     print('Player Name Segmentation:')
-    print(segments_df.to_string(index=False))
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(segments_df)
 
     plot_segments(segments_df)
 
@@ -2,35 +2,36 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
+#   "numba",
+#   "numpy",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
-#   "pandas",
 # ]
 # ///
 
 from pathlib import Path
 
 import duckdb
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
+from numba import njit, prange
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def plot_retention(df: pd.DataFrame, title: str, y_axis_title='Retention Rate (%)'):
+def plot_retention(df: pl.DataFrame, title: str, y_axis_title='Retention Rate (%)'):
     """Generates and displays a retention plot."""
-    fig = go.Figure()
-    for cohort in sorted(df['cohort'].unique()):
-        cohort_df = df[df['cohort'] == cohort]
-        fig.add_trace(
-            go.Scatter(
-                x=cohort_df['day'], y=cohort_df['retention'], mode='lines', name=str(cohort)
+    fig = go.Figure(
+        data=[
+            go.Scatter(x=days, y=retention, mode='lines', name=cohort)
+            for cohort, days, retention in (
+                df.group_by('cohort').agg('day', 'retention').sort('cohort').iter_rows()
             )
-        )
+        ]
+    )
     fig.update_layout(
         title=title,
         xaxis_title='Days Since Registration',
@@ -40,107 +41,108 @@ def plot_retention(df: pd.DataFrame, title: str, y_axis_title='Retention Rate (%
     fig.show()
 
 
-def get_overall_retention(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
-    """Calculates overall rolling retention."""
+COHORT_LEVELS = ('overall', 'yearly', 'quarterly', 'monthly')
+
+
+@njit(parallel=True, cache=True)
+def rolling_retention(counts: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Computes rolling retention (%) from per-day active counts.
+
+    `counts` holds the number of players last active on each day, sorted by day in
+    descending order within each cohort, and cohort `c` spans the rows
+    `offsets[c]:offsets[c + 1]`. The retention on a day is the share of the cohort that
+    was still active on that day or later, i.e. a reverse cumulative sum over the
+    cohort divided by its size. Cohorts are processed in parallel.
+    """
+    out = np.empty(len(counts), dtype=np.float64)
+    for c in prange(len(offsets) - 1):
+        start, end = offsets[c], offsets[c + 1]
+        total = 0
+        for i in range(start, end):
+            total += counts[i]
+            out[i] = total
+        for i in range(start, end):
+            out[i] = out[i] * 100.0 / total
+    return out
+
+
+def get_retention(con: duckdb.DuckDBPyConnection) -> dict[str, pl.DataFrame]:
+    """Calculates rolling retention overall and by yearly, quarterly and monthly cohorts.
+
+    All cohort levels are computed in a single scan of the players table using
+    grouping sets; the result is split into one DataFrame per level.
+    """
     query = """
         WITH player_days AS (
             SELECT
-                date_diff('day', regdate, COALESCE(lastlogin, regdate)) AS days_active
+                year(regdate) AS yearly,
+                date_trunc('quarter', regdate) AS quarterly,
+                date_trunc('month', regdate) AS monthly,
+                date_diff('day', regdate, last_activity) AS days_active
             FROM players
             WHERE regdate >= '2018-01-01'
         ),
-        total_players AS (
-            SELECT COUNT(*) AS total FROM players WHERE regdate >= '2018-01-01'
-        ),
         daily_retention AS (
             SELECT
-                days_active,
+                CASE GROUPING(yearly, quarterly, monthly)
+                    WHEN 7 THEN 'overall'
+                    WHEN 3 THEN 'yearly'
+                    WHEN 5 THEN 'quarterly'
+                    WHEN 6 THEN 'monthly'
+                END AS level,
+                yearly,
+                quarterly,
+                monthly,
+                days_active as day,
                 COUNT(*) as active_count
             FROM player_days
-            GROUP BY days_active
-        ),
-        rolling_retention AS (
-            SELECT
-                days_active as day,
-                SUM(active_count) OVER (ORDER BY days_active DESC) as retained_count
-            FROM daily_retention
+            GROUP BY GROUPING SETS (
+                (days_active),
+                (yearly, days_active),
+                (quarterly, days_active),
+                (monthly, days_active)
+            )
         )
         SELECT
-            'Overall' as cohort,
+            level,
+            CASE level
+                WHEN 'overall' THEN 'Overall'
+                WHEN 'yearly' THEN CAST(yearly AS VARCHAR)
+                WHEN 'quarterly' THEN strftime(quarterly, '%Y-Q') || quarter(quarterly)
+                WHEN 'monthly' THEN strftime(monthly, '%Y-%m')
+            END AS cohort,
             day,
-            (retained_count * 100.0 / (SELECT total FROM total_players)) as retention
-        FROM rolling_retention
-        ORDER BY day;
+            active_count
+        FROM daily_retention
+        ORDER BY level, cohort, day DESC;
     """
-    return con.execute(query).fetchdf()
+    df = con.execute(query).pl()
 
+    counts = df['active_count'].to_numpy()
+    is_group_start = df.select(pl.struct('level', 'cohort').is_first_distinct()).to_series()
+    offsets = np.append(np.flatnonzero(is_group_start.to_numpy()), len(counts))
+    df = df.with_columns(retention=rolling_retention(counts, offsets)).drop('active_count')
 
-def get_retention_by_cohort(con: duckdb.DuckDBPyConnection, period: str) -> pd.DataFrame:
-    """Calculates rolling retention grouped by a specific period (year, quarter, month)."""
-    cohort_format = {
-        'yearly': "strftime(regdate, '%Y')",
-        'quarterly': "strftime(regdate, '%Y-Q') || QUARTER(regdate)",
-        'monthly': "strftime(regdate, '%Y-%m')",
-    }[period]
-
-    query = f"""
-        WITH player_days AS (
-            SELECT
-                {cohort_format} AS cohort,
-                date_diff('day', regdate, COALESCE(lastlogin, regdate)) AS days_active
-            FROM players
-            WHERE regdate >= '2018-01-01'
-        ),
-        cohort_sizes AS (
-            SELECT cohort, COUNT(*) AS total FROM player_days GROUP BY cohort
-        ),
-        daily_retention AS (
-            SELECT
-                cohort,
-                days_active,
-                COUNT(*) as active_count
-            FROM player_days
-            GROUP BY cohort, days_active
-        ),
-        rolling_retention AS (
-            SELECT
-                cohort,
-                days_active as day,
-                SUM(active_count) OVER (PARTITION BY cohort ORDER BY days_active DESC) as retained_count
-            FROM daily_retention
-        )
-        SELECT
-            r.cohort,
-            r.day,
-            (r.retained_count * 100.0 / s.total) as retention
-        FROM rolling_retention r
-        JOIN cohort_sizes s ON r.cohort = s.cohort
-        ORDER BY r.cohort, r.day;
-    """
-    return con.execute(query).fetchdf()
+    levels = df.partition_by('level', as_dict=True, include_key=False)
+    return {level: levels[(level,)] for level in COHORT_LEVELS}
 
 
 def main():
     """Main function to generate and display all retention plots."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
+    retention = get_retention(con)
 
     # 1. Overall Retention
-    overall_df = get_overall_retention(con)
-    plot_retention(overall_df, 'Overall User Retention')
+    plot_retention(retention['overall'], 'Overall User Retention')
 
     # 2. Yearly Retention
-    yearly_df = get_retention_by_cohort(con, 'yearly')
-    plot_retention(yearly_df, 'Yearly User Retention Cohorts')
+    plot_retention(retention['yearly'], 'Yearly User Retention Cohorts')
 
     # 3. Quarterly Retention
-    quarterly_df = get_retention_by_cohort(con, 'quarterly')
-    plot_retention(quarterly_df, 'Quarterly User Retention Cohorts')
+    plot_retention(retention['quarterly'], 'Quarterly User Retention Cohorts')
 
     # 4. Monthly Retention
-    monthly_df = get_retention_by_cohort(con, 'monthly')
-    plot_retention(monthly_df, 'Monthly User Retention Cohorts')
-
-    con.close()
+    plot_retention(retention['monthly'], 'Monthly User Retention Cohorts')
 
 
 if __name__ == '__main__':
@@ -2,7 +2,8 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #   "duckdb",
-#   "pandas",
+#   "polars",
+#   "pyarrow",
 #   "plotly",
 # ]
 # ///
@@ -10,24 +11,22 @@
 from pathlib import Path
 
 import duckdb
-import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
+from db import get_players_connection
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'players.db'
 
 
-def get_connection():
-    """Establishes a connection to the DuckDB database."""
-    return duckdb.connect(str(DB_PATH), read_only=True)
-
-
-def get_yearly_name_segments(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+def get_yearly_name_segments(con: duckdb.DuckDBPyConnection) -> pl.DataFrame:
     """Gets the count of RP and non-RP names for each year."""
     query = """
         SELECT
-            strftime(regdate, '%Y') AS year,
+            year(regdate) AS year,
             CASE
-                WHEN regexp_matches(login, '^[A-Z][a-z]+_[A-Z][a-z]+$') THEN 'RP Names'
+                -- Cheap underscore position check first, so most logins skip the regex
+                WHEN strpos(login, '_') BETWEEN 3 AND length(login) - 2
+                    AND regexp_full_match(login, '[A-Z][a-z]+_[A-Z][a-z]+') THEN 'RP Names'
                 ELSE 'Not RP Names'
             END AS segment,
             COUNT(*) AS count
@@ -42,20 +41,13 @@ def get_yearly_name_segments(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
             year,
             segment;
     """
-    return con.execute(query).fetchdf()
+    return con.execute(query).pl()
 
 
-def plot_yearly_segments(df: pd.DataFrame):
+def plot_yearly_segments(df: pl.DataFrame):
     """Generates and displays a grouped bar chart of the segments."""
-    fig = go.Figure()
-
-    # Get unique years and segments
-    df['year'].unique()
-    segments = df['segment'].unique()
-
-    for segment in segments:
-        segment_df = df[df['segment'] == segment]
-        fig.add_trace(
+    fig = go.Figure(
+        data=[
             go.Bar(
                 x=segment_df['year'],
                 y=segment_df['count'],
@@ -63,7 +55,11 @@ def plot_yearly_segments(df: pd.DataFrame):
                 text=segment_df['count'],
                 textposition='auto',
             )
-        )
+            for (segment,), segment_df in df.partition_by(
+                'segment', as_dict=True, maintain_order=True
+            ).items()
+        ]
+    )
 
     fig.update_layout(
         barmode='group',
@@ -76,12 +72,12 @@ def plot_yearly_segments(df: pd.DataFrame):
 
 def main():
     """Main function to get, print, and plot yearly name segments."""
-    con = get_connection()
+    con = get_players_connection(str(DB_PATH))
     yearly_segments_df = get_yearly_name_segments(con)
-    con.close()
 
     print('Yearly Player Name Segmentation:')
-    print(yearly_segments_df.to_string(index=False))
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(yearly_segments_df)
 
     plot_yearly_segments(yearly_segments_df)
 
@@ -9,12 +9,13 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import NoReturn
 
+import telegramify_markdown
 import trio
 import trio_asyncio
 
 from tai.collection import collect_players, collect_sessions, collect_worlds
 from tai.database import init_db
-from tai.database.connector import get_connection
+from tai.database.connector import db_limiter, get_connection
 from tai.logging import log
 from tai.reports.digest import (
     Range,
@@ -25,12 +26,12 @@ from tai.reports.digest import (
 from tai.settings import settings
 from tai.telegram_utils import (
     init_telegram_bot,
-    send_telegram_message,
+    send_prepared_message,
     shutdown_telegram_bot,
 )
 
 
-async def weekly_players_collection(db_path: str, temp_db_path: str) -> NoReturn:
+async def weekly_players_collection(db_path: str, staging_path: str) -> NoReturn:
     """Periodically collect players data."""
     while True:
         with get_connection(db_path) as con:
@@ -52,7 +53,7 @@ async def weekly_players_collection(db_path: str, temp_db_path: str) -> NoReturn
                 await trio.sleep(wait_for)
 
         try:
-            await collect_players(db_path, temp_db_path)
+            await collect_players(db_path, staging_path)
 
         except Exception as e:
             log.error('players_collection_failed', error=e)
@@ -94,16 +95,20 @@ async def daily_digest_task() -> NoReturn:
             start, end = get_date_range(range_enum, report_date.isoformat())
 
             log.info('daily_digest_report_generation_started', range=range_enum.value)
-            data = get_digest_data(start, end)
+            # The queries run in a worker thread, so the collectors keep polling meanwhile.
+            # The limiter holds back their writes while the databases are attached
+            data = await trio.to_thread.run_sync(
+                get_digest_data, start, end, limiter=db_limiter
+            )
             _active_players_df, popular_worlds_df, _peak_online = data
 
             if not popular_worlds_df.is_empty():
                 report = render_digest_report(range_enum, start, end, data)
+                # Converted once, so the report isn't reformatted for every channel
+                formatted_report = telegramify_markdown.markdownify(report)
 
                 try:
-                    await send_telegram_message(
-                        report, settings.telegram_channel_id, send_as=settings.telegram_bot_id
-                    )
+                    await send_prepared_message(formatted_report, settings.telegram_channel_id)
                     log.info('daily_digest_sent_to_telegram', range=range_enum.value)
 
                 except Exception as e_telegram:
@@ -126,14 +131,13 @@ async def main():
     data_dir.mkdir(exist_ok=True)
     sessions_db_path = str(data_dir / 'sessions.db')
     players_db_path = str(data_dir / 'players.db')
-    players_temp_db_path = str(data_dir / 'players_temp.db')
+    players_staging_path = str(data_dir / 'players_staging.parquet')
     online_db_path = str(data_dir / 'online.db')
     worlds_online_db_path = str(data_dir / 'worlds_online.db')
     world_sessions_db_path = str(data_dir / 'world_sessions.db')
 
     init_db(sessions_db_path, 'schema_sessions.sql')
     init_db(players_db_path, 'schema_players.sql')
-    init_db(players_temp_db_path, 'schema_players.sql')
     init_db(online_db_path, 'schema_online.sql')
     init_db(worlds_online_db_path, 'schema_worlds_online.sql')
     init_db(world_sessions_db_path, 'schema_world_sessions.sql')
@@ -141,7 +145,7 @@ async def main():
     try:
         async with trio.open_nursery() as n:
             n.start_soon(collect_sessions, sessions_db_path, online_db_path)
-            n.start_soon(weekly_players_collection, players_db_path, players_temp_db_path)
+            n.start_soon(weekly_players_collection, players_db_path, players_staging_path)
             n.start_soon(collect_worlds, worlds_online_db_path, world_sessions_db_path)
             n.start_soon(daily_digest_task)
 
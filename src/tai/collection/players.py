@@ -1,4 +1,3 @@
-import zoneinfo
 from datetime import datetime
 from typing import Any
 
@@ -10,62 +9,139 @@ from tai.database.connector import get_connection
 from tai.logging import log
 from tai.settings import settings
 
+USER_URL = f'{settings.training_api_base_url}/user'
 
-def _preproc_timestamp(timestamp: str | int | None) -> datetime | None:
-    if timestamp is None:
-        return None
-    if timestamp == '1970-01-01 03:00:00':
-        return None
-    if timestamp == 0:
-        return None
-    moscow_tz = zoneinfo.ZoneInfo('Europe/Moscow')
-    dt_moscow = (
-        datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        if isinstance(timestamp, str)
-        else datetime.fromtimestamp(timestamp)
-    ).replace(tzinfo=moscow_tz)
-    dt_utc = dt_moscow.astimezone(zoneinfo.ZoneInfo('UTC'))
+# Player fields stored as returned by the API
+PLAYER_FIELDS = (
+    'id',
+    'login',
+    'lastlogin',
+    'regdate',
+    'moder',
+    'mute',
+    'verify',
+    'bonuspoints',
+    'premium_expdate',
+    'chase_rating',
+)
 
-    # Remove timezone awareness
-    dt_utc_naive = dt_utc.replace(tzinfo=None)
-    return dt_utc_naive
+# Top-level player columns holding Moscow time strings or Unix timestamps
+TIMESTAMP_COLUMNS = ('lastlogin', 'regdate', 'premium_expdate')
+
+# Schema of the preprocessed player records, matching the players table. Timestamps,
+# including warn ban times, are read as strings since the API mixes them with Unix
+# timestamps, and are converted afterwards
+PLAYER_SCHEMA = pl.Schema(
+    {
+        'id': pl.Int32,
+        'login': pl.String,
+        'lastlogin': pl.String,
+        'regdate': pl.String,
+        'moder': pl.Int32,
+        'mute': pl.Int32,
+        'verify': pl.Int32,
+        'bonuspoints': pl.UInt32,
+        'premium_expdate': pl.String,
+        'chase_rating': pl.Int32,
+        'premium': pl.Boolean,
+        'warn': pl.List(
+            pl.Struct({'admin': pl.String, 'bantime': pl.String, 'reason': pl.String})
+        ),
+        'verify_text': pl.String,
+    }
+)
+
+# Values the API returns instead of null timestamps
+NULL_TIMESTAMPS = ('1970-01-01 03:00:00', '0')
+
+
+def _utc_timestamp(value: pl.Expr) -> pl.Expr:
+    """Convert Moscow time strings or Unix timestamps to naive UTC datetimes.
+
+    Parameters
+    ----------
+    value
+        String expression; Unix timestamps are expected as digit strings.
+
+    Returns
+    -------
+    pl.Expr
+        Expression producing the converted datetimes. Values that can't be parsed
+        become null, since every branch is evaluated for all values.
+    """
+    moscow_time = (
+        value.str.to_datetime('%Y-%m-%d %H:%M:%S', strict=False)
+        .dt.replace_time_zone('Europe/Moscow', ambiguous='earliest', non_existent='null')
+        .dt.convert_time_zone('UTC')
+        .dt.replace_time_zone(None)
+    )
+    return (
+        pl.when(value.is_in(NULL_TIMESTAMPS))
+        .then(None)
+        .when(value.str.contains(r'^\d+$'))
+        .then(pl.from_epoch(value.cast(pl.Int64, strict=False), time_unit='s'))
+        .otherwise(moscow_time)
+    )
 
 
 def _preproc_player(player: dict[str, Any]) -> dict[str, Any]:
-    preprocessed_record = player | {
-        'lastlogin': _preproc_timestamp(player['lastlogin']),
-        'playerid': player['playerid'] if player['online'] else None,
-        'regdate': _preproc_timestamp(player['regdate']),
-        'bonuspoints': player['bonuspoints'],
-        'premium': bool(player['premium']),
-        'premium_expdate': _preproc_timestamp(player['premium_expdate']),
-        'chase_rating': player['chase_rating'],
-        'warn': [
-            warn | {'bantime': _preproc_timestamp(warn['bantime'])} for warn in player['warn']
-        ],
-        'verify_text': player['verifyText'],
-    }
-    for key in ('access', 'online', 'playerid', 'verifyText'):
-        preprocessed_record.pop(key)
+    record = {field: player[field] for field in PLAYER_FIELDS}
+    record['premium'] = bool(player['premium'])
+    record['warn'] = player['warn']
+    record['verify_text'] = player['verifyText']
+    return record
+
 
-    return preprocessed_record
+class _RateLimiter:
+    """Spaces API requests to stay under a request rate.
+
+    The rate is halved whenever the server responds with 429 Too Many Requests, and
+    recovers by a tenth of the configured rate after each successful request.
+
+    Parameters
+    ----------
+    rate
+        Maximum number of requests per second.
+    """
+
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self._next_request_time = 0.0
+
+    async def acquire(self):
+        """Wait until the next request is allowed."""
+        now = trio.current_time()
+        request_time = max(self._next_request_time, now)
+        self._next_request_time = request_time + 1 / self.rate
+        await trio.sleep_until(request_time)
+
+    def on_success(self):
+        """Increase the rate after a successful request."""
+        self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
+
+    def on_throttled(self):
+        """Decrease the rate after the server rejected a request as too frequent."""
+        self.rate = max(self.rate / 2, self.max_rate / 100)
 
 
 async def _fetch_first_page(
-    client: httpx.AsyncClient,
+    client: httpx.AsyncClient, rate_limiter: _RateLimiter
 ) -> tuple[list[dict[str, Any]], int]:
-    base_url = settings.training_api_base_url
     max_retry_attempts = 5
     initial_retry_delay = 2  # Start with a 2-second delay
     r = None
     for retry_attempt in range(1, max_retry_attempts + 1):
         try:
-            r = await client.get(f'{base_url}/user', timeout=30.0)
+            await rate_limiter.acquire()
+            r = await client.get(USER_URL, timeout=30.0)
             r.raise_for_status()
+            rate_limiter.on_success()
             break
         except Exception as e:
             if r and isinstance(e, httpx.HTTPStatusError) and r.status_code == 429:
                 delay = int(r.headers['Retry-After'])
+                rate_limiter.on_throttled()
             else:
                 # Exponential backoff: 2s, 4s, 8s, 16s
                 delay = initial_retry_delay * (2 ** (retry_attempt - 1))
@@ -81,24 +157,28 @@ async def _fetch_first_page(
             await trio.sleep(delay)
     else:
         raise TimeoutError('All retry attempts failed')
-    first = r.json()
-    pages = first['meta']['last_page']
-    return list(map(_preproc_player, r.json()['data'])), pages
+    payload = r.json()
+    pages = payload['meta']['last_page']
+    return list(map(_preproc_player, payload['data'])), pages
 
 
-async def _fetch_players_page(client: httpx.AsyncClient, page: int) -> list[dict[str, Any]]:
-    base_url = settings.training_api_base_url
+async def _fetch_players_page(
+    client: httpx.AsyncClient, rate_limiter: _RateLimiter, page: int
+) -> list[dict[str, Any]]:
     max_retry_attempts = 5
     initial_retry_delay = 2  # Start with a 2-second delay
     r = None
     for retry_attempt in range(1, max_retry_attempts + 1):
         try:
-            r = await client.get(f'{base_url}/user?page={page}', timeout=30.0)
+            await rate_limiter.acquire()
+            r = await client.get(USER_URL, params={'page': page}, timeout=30.0)
             r.raise_for_status()
+            rate_limiter.on_success()
             break
         except Exception as e:
             if r and isinstance(e, httpx.HTTPStatusError) and r.status_code == 429:
                 delay = int(r.headers['Retry-After'])
+                rate_limiter.on_throttled()
             else:
                 # Exponential backoff: 2s, 4s, 8s, 16s
                 delay = initial_retry_delay * (2 ** (retry_attempt - 1))
@@ -118,81 +198,105 @@ async def _fetch_players_page(client: httpx.AsyncClient, page: int) -> list[dict
     return list(map(_preproc_player, r.json()['data']))
 
 
-async def collect_players(db_path: str, temp_db_path: str):
+def _new_players(page_data: list[dict[str, Any]], seen_ids: set[int]) -> list[dict[str, Any]]:
+    """Return the players of a page not seen on earlier pages, marking them as seen."""
+    new_players = []
+    for player in page_data:
+        if player['id'] not in seen_ids:
+            seen_ids.add(player['id'])
+            new_players.append(player)
+    return new_players
+
+
+async def _fetch_pages(
+    client: httpx.AsyncClient, rate_limiter: _RateLimiter, pages: range, total_pages: int
+) -> dict[int, list[dict[str, Any]]]:
+    """Fetch the given pages concurrently, returning their players by page number."""
+    results: dict[int, list[dict[str, Any]]] = {}
+    limiter = trio.CapacityLimiter(settings.training_api_concurrency)
+
+    async def fetch(page: int):
+        async with limiter:
+            log.debug('fetch_players_page', page=page, of=total_pages)
+            results[page] = await _fetch_players_page(client, rate_limiter, page)
+
+    async with trio.open_nursery() as n:
+        for page in pages:
+            n.start_soon(fetch, page)
+
+    return results
+
+
+async def collect_players(db_path: str, staging_path: str):
     """
     Collect all player data from the training server API and insert into the database.
 
-    This function fetches player data into a temporary database file first, then uses
-    the ATTACH command to transfer the data to the main database. This minimizes
-    the time the main database file is locked.
+    Pages are fetched concurrently and accumulated in memory, then written to a Parquet
+    staging file that is bulk-loaded into the main database with a single insert. The
+    main database file is only locked for that insert.
     """
     log.info('players_collection_started')
     snapshot_time = datetime.now()
+    collected: list[dict[str, Any]] = []
+    seen_ids: set[int] = set()
 
-    with get_connection(temp_db_path) as temp_con:
-        log.warning('clearing_temp_players_table')
-        temp_con.execute('DELETE FROM players')
-        async with httpx.AsyncClient() as client:
-            first, total_pages = await _fetch_first_page(client)
-            log.debug('fetch_players_page', page=1, of=total_pages)
-
-            for row in first:
-                row['snapshot_time'] = snapshot_time
-
-            _ = pl.from_dicts(first)
-            res = temp_con.execute(
-                'INSERT INTO players BY NAME SELECT * FROM _ ON CONFLICT (id, snapshot_time) DO NOTHING RETURNING *'
-            ).fetchall()
-            inserted_count = len(res)
-            if inserted_count != len(first):
-                log.warning(
-                    'duplicate_players_found',
-                    page=1,
-                    expected=len(first),
-                    inserted=inserted_count,
-                )
-                base_url = settings.training_api_base_url
-                r = await client.get(f'{base_url}/user')
-                meta = r.json()['meta']
-                new_total_pages = meta['last_page']
-                if new_total_pages != total_pages:
-                    log.warning('total_pages_changed', old=total_pages, new=new_total_pages)
-                    total_pages = new_total_pages
-            await trio.sleep(0.8)
-
-            page = 2
-            while page <= total_pages:
-                log.debug('fetch_players_page', page=page, of=total_pages)
-                page_data = await _fetch_players_page(client, page)
-                for row in page_data:
-                    row['snapshot_time'] = snapshot_time
-
-                _ = pl.from_dicts(page_data)
-                res = temp_con.execute(
-                    'INSERT INTO players BY NAME SELECT * FROM _ ON CONFLICT (id, snapshot_time) DO NOTHING RETURNING *'
-                ).fetchall()
-                inserted_count = len(res)
-                if inserted_count != len(page_data):
+    limits = httpx.Limits(
+        max_connections=settings.training_api_concurrency,
+        max_keepalive_connections=settings.training_api_concurrency,
+    )
+    rate_limiter = _RateLimiter(settings.training_api_rate_limit_rps)
+    async with httpx.AsyncClient(limits=limits) as client:
+        first, total_pages = await _fetch_first_page(client, rate_limiter)
+        log.debug('fetch_players_page', page=1, of=total_pages)
+
+        fetched = {1: first}
+        next_page = 2
+        while True:
+            # Pages are deduplicated in order, so players shifted onto a later page by
+            # new registrations are kept from the page where they were seen first
+            duplicates_found = False
+            for page, page_data in sorted(fetched.items()):
+                new_players = _new_players(page_data, seen_ids)
+                collected.extend(new_players)
+                if len(new_players) != len(page_data):
                     log.warning(
                         'duplicate_players_found',
                         page=page,
                         expected=len(page_data),
-                        inserted=inserted_count,
+                        inserted=len(new_players),
                     )
-                    base_url = settings.training_api_base_url
-                    r = await client.get(f'{base_url}/user')
-                    meta = r.json()['meta']
-                    new_total_pages = meta['last_page']
-                    if new_total_pages != total_pages:
-                        log.info('total_pages_changed', old=total_pages, new=new_total_pages)
-                        total_pages = new_total_pages
-                await trio.sleep(0.8)
-                page += 1
+                    duplicates_found = True
+
+            if duplicates_found:
+                await rate_limiter.acquire()
+                r = await client.get(USER_URL)
+                meta = r.json()['meta']
+                new_total_pages = meta['last_page']
+                if new_total_pages != total_pages:
+                    log.info('total_pages_changed', old=total_pages, new=new_total_pages)
+                    total_pages = new_total_pages
+
+            if next_page > total_pages:
+                break
+            fetched = await _fetch_pages(
+                client, rate_limiter, range(next_page, total_pages + 1), total_pages
+            )
+            next_page = total_pages + 1
+
+    players_df = pl.from_dicts(collected, schema=PLAYER_SCHEMA, strict=False).with_columns(
+        *(_utc_timestamp(pl.col(column)).alias(column) for column in TIMESTAMP_COLUMNS),
+        pl.col('warn').list.eval(
+            pl.element().struct.with_fields(
+                _utc_timestamp(pl.field('bantime')).alias('bantime')
+            )
+        ),
+        snapshot_time=pl.lit(snapshot_time),
+    )
+    players_df.write_parquet(staging_path)
 
     with get_connection(db_path) as main_con:
-        main_con.execute(f"ATTACH '{temp_db_path}' AS temp_db")
-        main_con.execute('INSERT INTO players SELECT * FROM temp_db.players')
-        inserted_count = main_con.execute('SELECT COUNT(*) FROM temp_db.players').fetchone()[0]
-        main_con.execute('DETACH temp_db')
+        inserted_count = main_con.execute(
+            f"INSERT INTO players BY NAME SELECT * FROM read_parquet('{staging_path}')"
+        ).fetchone()[0]
 
     log.info('players_collection_completed', inserted=inserted_count)
@@ -1,14 +1,17 @@
+import logging
 import time
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import NoReturn
 
 import trio
 
-from tai.database.connector import get_connection
+from tai.database.connector import db_limiter, get_connection
 from tai.logging import log
 from tai.samp import create_client
 
 
+@lru_cache(maxsize=512)
 def format_timestamp(timestamp: int) -> str:
     """Format Unix timestamp as ISO datetime string.
 
@@ -30,6 +33,7 @@ async def collect_sessions(
     online_db_path: str,
     session_threshold: int = 2700,
     delay: int = 60,
+    max_delay: int = 300,
 ) -> NoReturn:
     """
     Continuously monitor player connections and track gaming sessions.
@@ -48,49 +52,61 @@ async def collect_sessions(
     session_threshold
         Time in seconds after disconnect before a session is considered ended.
     delay
-        Time in seconds to wait between server queries.
+        Time in seconds to wait between server queries. The wait is shortened while
+        players are connecting or disconnecting, and grows by half after each query
+        without changes, up to `max_delay`.
+    max_delay
+        Maximum time in seconds to wait between server queries.
     """
     log.info('sessions_collection_started')
     active_sessions: dict[str, int] = {}
+    # Naive UTC starts of active and suspended sessions, as stored in the database
+    session_starts: dict[str, datetime] = {}
     suspended_sessions: dict[str, tuple[int, int]] = {}  # player -> (start_ts, suspended_ts)
 
+    # The client keeps its socket between queries and is only recreated after a failure
+    client = create_client()
+
     # --- Startup Recovery Step ---
     try:
         log.info('session_recovery_started')
-        client = create_client()
-        initial_players = set(p.name for p in (await client.players()).players)
+        initial_players = frozenset(p.name for p in (await client.players()).players)
 
         if initial_players:
-            with get_connection(sessions_db_path) as con:
-                threshold_time = datetime.fromtimestamp(
-                    time.time() - session_threshold, tz=timezone.utc
-                ).replace(tzinfo=None)
-                query = """
-                    SELECT
-                        player,
-                        ARG_MAX(session_start, session_end) AS latest_start
-                    FROM sessions
-                    WHERE player IN (SELECT * FROM UNNEST(?))
-                    GROUP BY player
-                    HAVING MAX(session_end) > ?
-                """
-                recoverable = con.execute(
-                    query, (list(initial_players), threshold_time)
-                ).fetchall()
-
-                for player, session_start in recoverable:
-                    active_sessions[player] = int(session_start.timestamp())
-                    log.debug(
-                        'session_recovered',
-                        player=player,
-                        session_start=session_start.isoformat(),
-                    )
+            async with db_limiter:
+                with get_connection(sessions_db_path) as con:
+                    threshold_time = datetime.fromtimestamp(
+                        time.time() - session_threshold, tz=timezone.utc
+                    ).replace(tzinfo=None)
+                    query = """
+                        SELECT
+                            player,
+                            ARG_MAX(session_start, session_end) AS latest_start
+                        FROM sessions
+                        WHERE player IN (SELECT * FROM UNNEST(?))
+                        GROUP BY player
+                        HAVING MAX(session_end) > ?
+                    """
+                    recoverable = con.execute(
+                        query, (list(initial_players), threshold_time)
+                    ).fetchall()
+
+                    for player, session_start in recoverable:
+                        active_sessions[player] = int(session_start.timestamp())
+                        session_starts[player] = session_start
+                        log.debug(
+                            'session_recovered',
+                            player=player,
+                            session_start=session_start.isoformat(),
+                        )
     except Exception:
         log.exception('session_recovery_failed')
-        initial_players = set()
+        initial_players = frozenset()
 
     prev_players = initial_players
     previous_online_count = None
+    current_delay = delay
+    last_update_minute = None
 
     # --- Main Collection Loop ---
     while True:
@@ -98,14 +114,14 @@ async def collect_sessions(
         players = None
         try:
             with trio.move_on_after(10):
-                client = create_client()
-                players = set(p.name for p in (await client.players()).players)
+                players = frozenset(p.name for p in (await client.players()).players)
         except trio.Cancelled:
             log.debug('samp_query_timeout')
         except Exception:
             log.exception('failed_to_query_server_players')
 
         if players is None:
+            client = create_client()
             await trio.sleep(delay)
             continue
 
@@ -113,11 +129,12 @@ async def collect_sessions(
         current_online_count = len(players)
         if current_online_count != previous_online_count:
             queried_at = datetime.fromtimestamp(now, tz=timezone.utc).replace(tzinfo=None)
-            with get_connection(online_db_path) as con:
-                con.execute(
-                    'INSERT INTO online (online_count, queried_at) VALUES (?, ?)',
-                    (current_online_count, queried_at),
-                )
+            async with db_limiter:
+                with get_connection(online_db_path) as con:
+                    con.execute(
+                        'INSERT INTO online (online_count, queried_at) VALUES (?, ?)',
+                        (current_online_count, queried_at),
+                    )
             log.debug(
                 'online_count_changed',
                 online_count=current_online_count,
@@ -125,69 +142,112 @@ async def collect_sessions(
             )
             previous_online_count = current_online_count
 
-        newly_connected = players - prev_players
-        disconnected = prev_players - players
+        # Most polls see the same players, so only diff the sets when they differ
+        players_changed = players != prev_players
+        if players_changed:
+            newly_connected = players - prev_players
+            disconnected = prev_players - players
+        else:
+            newly_connected = disconnected = frozenset()
+
+        # Start times are only formatted for logging when debug logging is enabled
+        log_debug = log.isEnabledFor(logging.DEBUG)
 
         # --- Handle Disconnected Players (Session Suspension) ---
         for player in disconnected:
             if player in active_sessions:
                 start_time = active_sessions.pop(player)
                 suspended_sessions[player] = (start_time, now)
-                log.debug(
-                    'session_suspended', player=player, start_time=format_timestamp(start_time)
-                )
+                if log_debug:
+                    log.debug(
+                        'session_suspended',
+                        player=player,
+                        start_time=format_timestamp(start_time),
+                    )
 
         # --- Handle Newly Connected Players (Session Resume or New) ---
-        if newly_connected:
-            with get_connection(sessions_db_path) as con:
-                for player in newly_connected:
-                    if player in suspended_sessions:
-                        start_time, _ = suspended_sessions.pop(player)
-                        active_sessions[player] = start_time
-                        log.debug(
-                            'session_renewed',
-                            player=player,
-                            start_time=format_timestamp(start_time),
-                        )
-                    else:
-                        start_time = now
-                        active_sessions[player] = start_time
-                        dt_start = datetime.fromtimestamp(start_time, tz=timezone.utc).replace(
-                            tzinfo=None
-                        )
-                        con.execute(
-                            'INSERT INTO sessions (player, session_start, session_end) VALUES (?, ?, ?)',
-                            (player, dt_start, dt_start),
-                        )
-                        log.debug(
-                            'session_started', player=player, session_start=dt_start.isoformat()
-                        )
+        new_sessions = []
+        for player in newly_connected:
+            if player in suspended_sessions:
+                start_time, _ = suspended_sessions.pop(player)
+                active_sessions[player] = start_time
+                if log_debug:
+                    log.debug(
+                        'session_renewed',
+                        player=player,
+                        start_time=format_timestamp(start_time),
+                    )
+            else:
+                start_time = now
+                active_sessions[player] = start_time
+                dt_start = datetime.fromtimestamp(start_time, tz=timezone.utc).replace(
+                    tzinfo=None
+                )
+                session_starts[player] = dt_start
+                new_sessions.append((player, dt_start, dt_start))
+                if log_debug:
+                    log.debug(
+                        'session_started', player=player, session_start=dt_start.isoformat()
+                    )
 
         # --- Finalize Expired Suspended Sessions ---
-        for player, (start_time, suspended_at) in list(suspended_sessions.items()):
-            if now - suspended_at > session_threshold:
-                del suspended_sessions[player]
+        # Sessions are suspended in time order, so stop at the first one still within
+        # the threshold instead of scanning every suspended session
+        expired_players = []
+        for player, (start_time, suspended_at) in suspended_sessions.items():
+            if now - suspended_at <= session_threshold:
+                break
+            expired_players.append(player)
+            if log_debug:
                 log.debug(
                     'session_ended', player=player, start_time=format_timestamp(start_time)
                 )
+        for player in expired_players:
+            del suspended_sessions[player]
+            del session_starts[player]
 
         # --- Update Active Sessions ---
-        if active_sessions:
-            with get_connection(sessions_db_path) as con:
-                dt_now = datetime.fromtimestamp(now, tz=timezone.utc).replace(tzinfo=None)
-                update_data = [
-                    (
-                        dt_now,
-                        player,
-                        datetime.fromtimestamp(start_ts, tz=timezone.utc).replace(tzinfo=None),
-                    )
-                    for player, start_ts in active_sessions.items()
-                ]
-                con.executemany(
-                    'UPDATE sessions SET session_end = ? WHERE player = ? AND session_start = ?',
-                    update_data,
-                )
+        # Skip rewriting session ends within the same minute if no one connected or left
+        update_minute = now // 60
+        update_sessions = bool(active_sessions) and (
+            players_changed or update_minute != last_update_minute
+        )
+
+        # --- Write Session Changes ---
+        # New sessions and session ends are written in a single transaction, which waits
+        # while the digest has the database attached
+        if new_sessions or update_sessions:
+            async with db_limiter:
+                with get_connection(sessions_db_path) as con:
+                    con.begin()
+                    if new_sessions:
+                        con.executemany(
+                            'INSERT INTO sessions (player, session_start, session_end) VALUES (?, ?, ?)',
+                            new_sessions,
+                        )
+                    if update_sessions:
+                        last_update_minute = update_minute
+                        dt_now = datetime.fromtimestamp(now, tz=timezone.utc).replace(
+                            tzinfo=None
+                        )
+                        update_data = [
+                            (dt_now, player, session_starts[player])
+                            for player in active_sessions
+                        ]
+                        con.executemany(
+                            'UPDATE sessions SET session_end = ? WHERE player = ? AND session_start = ?',
+                            update_data,
+                        )
+                    con.commit()
+            if update_sessions:
                 log.debug('active_sessions_updated', count=len(active_sessions))
 
-        prev_players = players
-        await trio.sleep(delay)
+        # --- Adapt Polling Interval ---
+        if players_changed:
+            current_delay = max(delay // 4, 5)
+        else:
+            current_delay = min(current_delay * 1.5, max_delay)
+
+        if players_changed:
+            prev_players = players
+        await trio.sleep(current_delay)
@@ -1,20 +1,70 @@
+import logging
 import re
 import time
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Any, NoReturn
 
 import httpx
+import polars as pl
 import trio
 from trio import MemoryReceiveChannel, MemorySendChannel
 
-from tai.database.connector import get_connection
+from tai.database.connector import db_limiter, get_connection
 from tai.logging import log
 from tai.settings import settings
 
+HEX_CODE_PATTERN = re.compile(r'\{[0-9a-fA-F]{6}\}')
 
+
+@lru_cache(maxsize=4096)
 def _strip_hex_codes(text: str) -> str:
     """Remove hex color codes from a string."""
-    return re.sub(r'\{([0-9a-fA-F]{6})\}', '', text)
+    # World names repeat on every poll, so stripped names are cached. Most names have
+    # no color codes and skip the regex entirely
+    return HEX_CODE_PATTERN.sub('', text) if '{' in text else text
+
+
+@lru_cache(maxsize=4096)
+def _utc_datetime(timestamp: int) -> datetime:
+    """Convert a session start Unix timestamp to a naive UTC datetime."""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _save_worlds_online(db_path: str, rows: list[tuple[Any, ...]]) -> None:
+    """Insert changed world snapshots in a single transaction."""
+    with get_connection(db_path) as con:
+        con.begin()
+        con.executemany(
+            'INSERT INTO worlds_online (name, players, static, ssmp, saved_at) VALUES (?, ?, ?, ?, ?)',
+            rows,
+        )
+        con.commit()
+
+
+def _save_world_sessions(
+    db_path: str,
+    new_sessions: list[tuple[str, datetime, datetime]],
+    update_data: list[tuple[datetime, str, datetime]],
+) -> None:
+    """Insert new world sessions and update session ends in a single transaction."""
+    with get_connection(db_path) as con:
+        con.begin()
+        if new_sessions:
+            con.executemany(
+                'INSERT INTO world_sessions (name, session_start, session_end) VALUES (?, ?, ?)',
+                new_sessions,
+            )
+        con.executemany(
+            'UPDATE world_sessions SET session_end = ? WHERE name = ? AND session_start = ?',
+            update_data,
+        )
+        con.commit()
+
+
+def _format_session_starts(starts: dict[str, int]) -> dict[str, str]:
+    """Format world session start timestamps as ISO datetime strings for logging."""
+    return {world: datetime.fromtimestamp(start).isoformat() for world, start in starts.items()}
 
 
 async def _fetch_worlds_data(
@@ -26,17 +76,23 @@ async def _fetch_worlds_data(
     log.info('worlds_data_fetching_started')
     url = f'{settings.chrono_api_base_url}/worlds'
 
-    async with httpx.AsyncClient() as client:
+    # A single connection is kept alive between polls, so each tick skips the TCP and TLS
+    # handshakes as long as the idle interval fits within the keep-alive expiry
+    limits = httpx.Limits(
+        max_connections=1,
+        max_keepalive_connections=1,
+        keepalive_expiry=max(delay * 2, 5),
+    )
+    async with httpx.AsyncClient(
+        headers={'X-Login': settings.chrono_login, 'X-Token': settings.chrono_token},
+        timeout=8,
+        limits=limits,
+    ) as client:
+        # The request never changes, so it's built once and resent on every poll
+        request = client.build_request('GET', url)
         while True:
             try:
-                response = await client.get(
-                    url,
-                    headers={
-                        'X-Login': settings.chrono_login,
-                        'X-Token': settings.chrono_token,
-                    },
-                    timeout=8,
-                )
+                response = await client.send(request)
                 response.raise_for_status()
                 data = response.json()
             except httpx.HTTPError as e:
@@ -44,8 +100,17 @@ async def _fetch_worlds_data(
                 await trio.sleep(delay)
                 continue
 
-            await online_worlds_sender.send(data)
-            await world_sessions_sender.send(data)
+            # The buffers absorb a slow database write, so a full one means a consumer
+            # is falling behind the fetch cadence
+            for channel, sender in (
+                ('worlds_online', online_worlds_sender),
+                ('world_sessions', world_sessions_sender),
+            ):
+                try:
+                    sender.send_nowait(data)
+                except trio.WouldBlock:
+                    log.warning('worlds_data_channel_full', channel=channel)
+                    await sender.send(data)
             await trio.sleep(delay)
 
 
@@ -55,62 +120,49 @@ async def _collect_worlds_online(
 ) -> NoReturn:
     """Continuously monitor world data and save changes."""
     log.info('worlds_online_collection_started')
-    previous_worlds = {}
+    # world_name -> (players, static, ssmp)
+    previous_worlds: dict[str, tuple[int, bool, bool]] = {}
 
     async for data in receiver:
-        current_worlds = {}
+        current_worlds: dict[str, tuple[int, bool, bool]] = {}
         for world in data['worlds']:
             world_name = _strip_hex_codes(world['name'])
-            world_data = {
-                'players': world['players'],
-                'static': world['static'],
-                'ssmp': world['ssmp'],
-            }
+            world_data = (world['players'], world['static'], world['ssmp'])
             if (
                 world_name not in current_worlds
-                or world_data['players'] > current_worlds[world_name]['players']
+                or world_data[0] > current_worlds[world_name][0]
             ):
                 current_worlds[world_name] = world_data
 
-        if current_worlds != previous_worlds:
-            for world_name, world_data in current_worlds.items():
-                prev_players = previous_worlds.get(world_name, {}).get('players')
-                curr_players = world_data.get('players')
-                if prev_players and prev_players != curr_players:
-                    log.debug(
-                        'world_online_count_changed',
-                        world_name=world_name,
-                        new_count=curr_players,
-                        old_count=prev_players,
-                    )
-            with get_connection(db_path) as con:
-                saved_count = 0
-                for world_name, world_data in current_worlds.items():
-                    if previous_worlds.get(world_name) != world_data:
-                        saved_at = datetime.now(timezone.utc).replace(
-                            microsecond=0, tzinfo=None
-                        )
-                        con.execute(
-                            'INSERT INTO worlds_online (name, players, static, ssmp, saved_at) VALUES (?, ?, ?, ?, ?)',
-                            (
-                                world_name,
-                                world_data['players'],
-                                world_data['static'],
-                                world_data['ssmp'],
-                                saved_at,
-                            ),
-                        )
-                        saved_count += 1
-                if saved_count > 0:
-                    log.debug('worlds_data_saved', count=saved_count)
+        saved_at = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+        rows = []
+        count_changes: dict[str, tuple[int, int]] = {}  # world_name -> (old, new)
+        for world_name, world_data in current_worlds.items():
+            prev_data = previous_worlds.get(world_name)
+            if prev_data == world_data:
+                continue
+            rows.append((world_name, *world_data, saved_at))
+            if prev_data and prev_data[0] and prev_data[0] != world_data[0]:
+                count_changes[world_name] = (prev_data[0], world_data[0])
+        if count_changes:
+            log.debug('world_online_counts_changed', worlds=count_changes)
+
+        if rows:
+            # Writes run in a worker thread, so a slow commit doesn't stall the fetcher. The
+            # limiter keeps them from overlapping with the digest attaching the same file
+            await trio.to_thread.run_sync(
+                _save_worlds_online, db_path, rows, limiter=db_limiter
+            )
+            log.debug('worlds_data_saved', count=len(rows))
 
-            previous_worlds = current_worlds
+        previous_worlds = current_worlds
 
 
 async def _collect_world_sessions(
     db_path: str,
     receiver: MemoryReceiveChannel[dict[str, Any]],
     session_threshold: int = 1800,
+    update_interval: int = 300,
 ) -> NoReturn:
     """Continuously monitor world connections and track gaming sessions."""
     log.info('world_sessions_collection_started')
@@ -119,6 +171,8 @@ async def _collect_world_sessions(
         str, tuple[int, int]
     ] = {}  # world_name -> (start_ts, suspended_ts)
     prev_worlds: set[str] = set()
+    prev_now = 0
+    last_update = 0
     is_first_iteration = True
 
     async for data in receiver:
@@ -130,31 +184,36 @@ async def _collect_world_sessions(
             log.info('world_session_recovery_started')
             recovered_worlds = set()
             if current_worlds:
-                with get_connection(db_path) as con:
-                    threshold_time = datetime.fromtimestamp(
-                        now - session_threshold, tz=timezone.utc
-                    ).replace(tzinfo=None)
-                    query = """
-                        SELECT
-                            name,
-                            ARG_MAX(session_start, session_end) AS latest_start
-                        FROM world_sessions
-                        WHERE name IN (SELECT * FROM UNNEST(?))
-                        GROUP BY name
-                        HAVING MAX(session_end) > ?
-                    """
-                    recoverable = con.execute(
-                        query, (list(current_worlds), threshold_time)
-                    ).fetchall()
-
-                    for world_name, session_start in recoverable:
-                        active_sessions[world_name] = int(session_start.timestamp())
-                        recovered_worlds.add(world_name)
-                        log.debug(
-                            'world_session_recovered',
-                            world=world_name,
-                            session_start=session_start.isoformat(),
+                async with db_limiter:
+                    with get_connection(db_path) as con:
+                        threshold_time = datetime.fromtimestamp(
+                            now - session_threshold, tz=timezone.utc
+                        ).replace(tzinfo=None)
+                        con.register(
+                            'current_worlds', pl.DataFrame({'name': list(current_worlds)})
                         )
+                        query = """
+                            SELECT
+                                name,
+                                ARG_MAX(session_start, session_end) AS latest_start
+                            FROM world_sessions
+                            WHERE name IN (SELECT name FROM current_worlds)
+                            GROUP BY name
+                            HAVING MAX(session_end) > ?
+                        """
+                        recoverable = con.execute(query, (threshold_time,)).fetchall()
+
+                        for world_name, session_start in recoverable:
+                            active_sessions[world_name] = int(session_start.timestamp())
+                            recovered_worlds.add(world_name)
+                        if recoverable:
+                            log.debug(
+                                'world_sessions_recovered',
+                                worlds={
+                                    world_name: session_start.isoformat()
+                                    for world_name, session_start in recoverable
+                                },
+                            )
 
             newly_connected = current_worlds - recovered_worlds
             is_first_iteration = False
@@ -163,73 +222,82 @@ async def _collect_world_sessions(
 
         disconnected = prev_worlds - current_worlds
 
+        # Session events are collected as world -> start timestamp and logged once per
+        # category and tick. Start times are only formatted when debug logging is enabled
+        log_debug = log.isEnabledFor(logging.DEBUG)
+
         # --- Handle Disconnected Worlds (Session Suspension) ---
+        suspended: dict[str, int] = {}
         for world in disconnected:
             if world in active_sessions:
                 start_time = active_sessions.pop(world)
                 suspended_sessions[world] = (start_time, now)
-                log.debug(
-                    'world_session_suspended',
-                    world=world,
-                    start_time=datetime.fromtimestamp(start_time).isoformat(),
-                )
+                suspended[world] = start_time
+        if suspended and log_debug:
+            log.debug('world_sessions_suspended', worlds=_format_session_starts(suspended))
 
         # --- Handle Newly Connected Worlds (Session Resume or New) ---
-        if newly_connected:
-            with get_connection(db_path) as con:
-                for world in newly_connected:
-                    if world in suspended_sessions:
-                        start_time, _ = suspended_sessions.pop(world)
-                        active_sessions[world] = start_time
-                        log.debug(
-                            'world_session_renewed',
-                            world=world,
-                            start_time=datetime.fromtimestamp(start_time).isoformat(),
-                        )
-                    else:
-                        start_time = now
-                        active_sessions[world] = start_time
-                        dt_start = datetime.fromtimestamp(start_time, tz=timezone.utc).replace(
-                            tzinfo=None
-                        )
-                        con.execute(
-                            'INSERT INTO world_sessions (name, session_start, session_end) VALUES (?, ?, ?)',
-                            (world, dt_start, dt_start),
-                        )
-                        log.debug(
-                            'world_session_started',
-                            world=world,
-                            session_start=dt_start.isoformat(),
-                        )
+        new_sessions = []
+        renewed: dict[str, int] = {}
+        for world in newly_connected:
+            if world in suspended_sessions:
+                start_time, _ = suspended_sessions.pop(world)
+                active_sessions[world] = start_time
+                renewed[world] = start_time
+            else:
+                active_sessions[world] = now
+                dt_start = _utc_datetime(now)
+                new_sessions.append((world, dt_start, dt_start))
+        if renewed and log_debug:
+            log.debug('world_sessions_renewed', worlds=_format_session_starts(renewed))
+        if new_sessions and log_debug:
+            log.debug(
+                'world_sessions_started',
+                worlds=[world for world, _, _ in new_sessions],
+                session_start=new_sessions[0][1].isoformat(),
+            )
 
         # --- Finalize Expired Suspended Sessions ---
+        saved: dict[str, int] = {}
         for world, (start_time, suspended_at) in list(suspended_sessions.items()):
             if now - suspended_at > session_threshold:
                 del suspended_sessions[world]
-                log.debug(
-                    'world_session_saved',
-                    world=world,
-                    start_time=datetime.fromtimestamp(start_time).isoformat(),
-                )
+                saved[world] = start_time
+        if saved and log_debug:
+            log.debug('world_sessions_saved', worlds=_format_session_starts(saved))
 
-        # --- Update Active Sessions ---
-        if active_sessions:
-            with get_connection(db_path) as con:
+        # --- Write Session Changes ---
+        # Session ends are only rewritten when worlds came or went, and otherwise every
+        # `update_interval` seconds to keep them recoverable after a restart. Suspended
+        # sessions end when their world was last seen, which may not have been written yet.
+        # New sessions are always active, so they're inserted in the same transaction.
+        update_sessions = bool(active_sessions) and (
+            bool(newly_connected or disconnected) or now - last_update >= update_interval
+        )
+        if update_sessions or suspended:
+            dt_prev_now = datetime.fromtimestamp(prev_now, tz=timezone.utc).replace(tzinfo=None)
+            update_data = [
+                (dt_prev_now, world, _utc_datetime(start_ts))
+                for world, start_ts in suspended.items()
+            ]
+            if update_sessions:
+                last_update = now
                 dt_now = datetime.fromtimestamp(now, tz=timezone.utc).replace(tzinfo=None)
-                update_data = [
-                    (
-                        dt_now,
-                        world,
-                        datetime.fromtimestamp(start_ts, tz=timezone.utc).replace(tzinfo=None),
-                    )
+                update_data.extend(
+                    (dt_now, world, _utc_datetime(start_ts))
                     for world, start_ts in active_sessions.items()
-                ]
-                con.executemany(
-                    'UPDATE world_sessions SET session_end = ? WHERE name = ? AND session_start = ?',
-                    update_data,
                 )
+            await trio.to_thread.run_sync(
+                _save_world_sessions,
+                db_path,
+                new_sessions,
+                update_data,
+                limiter=db_limiter,
+            )
+            if update_sessions:
                 log.debug('active_world_sessions_updated', count=len(active_sessions))
 
+        prev_now = now
         prev_worlds = current_worlds
 
 
@@ -240,8 +308,8 @@ async def collect_worlds(
     session_threshold: int = 1800,
 ) -> NoReturn:
     """Continuously monitor world data and save changes."""
-    online_worlds_sender, online_worlds_receiver = trio.open_memory_channel[dict[str, Any]](0)
-    world_sessions_sender, world_sessions_receiver = trio.open_memory_channel[dict[str, Any]](0)
+    online_worlds_sender, online_worlds_receiver = trio.open_memory_channel[dict[str, Any]](4)
+    world_sessions_sender, world_sessions_receiver = trio.open_memory_channel[dict[str, Any]](4)
     async with trio.open_nursery() as n:
         n.start_soon(_fetch_worlds_data, online_worlds_sender, world_sessions_sender, delay)
         n.start_soon(_collect_worlds_online, online_db_path, online_worlds_receiver)
@@ -1,8 +1,38 @@
 import duckdb
+import trio
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from tai.settings import settings
+
+# DuckDB refuses to open a file that another connection in the process holds. The digest
+# attaches the session, online and worlds databases from a worker thread while the
+# collectors write them, so all of that access goes through this limiter
+db_limiter = trio.CapacityLimiter(1)
+
+
+def _connection_config() -> dict[str, str | int]:
+    """Build the DuckDB configuration shared by all collector connections."""
+    config: dict[str, str | int] = {
+        'memory_limit': settings.duckdb_memory_limit,
+        'checkpoint_threshold': settings.duckdb_checkpoint_threshold,
+    }
+    if settings.duckdb_threads is not None:
+        config['threads'] = settings.duckdb_threads
+    if settings.duckdb_temp_directory is not None:
+        config['temp_directory'] = settings.duckdb_temp_directory
+    return config
+
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 def get_connection(db_path: str) -> duckdb.DuckDBPyConnection:
     """Get a duckdb connection with retry."""
-    return duckdb.connect(db_path)
+    return duckdb.connect(db_path, config=_connection_config())
+
+
+def get_report_connection() -> duckdb.DuckDBPyConnection:
+    """Get an in-memory duckdb connection for reports over attached databases."""
+    # Reports run inside the service, so they share its thread and memory limits. The
+    # progress bar would only write to the service's stdout, and can only be set per session
+    con = duckdb.connect(config=_connection_config())
+    con.execute('SET enable_progress_bar = false')
+    return con
@@ -18,11 +18,14 @@ shared_processors: list[structlog.types.Processor] = [
 ]
 
 structlog.configure(
-    processors=shared_processors
+    # Drop events below the configured level before running the processor chain
+    processors=[structlog.stdlib.filter_by_level]
+    + shared_processors
     + [
         structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
     ],
     logger_factory=structlog.stdlib.LoggerFactory(),
+    wrapper_class=structlog.stdlib.BoundLogger,
     cache_logger_on_first_use=True,
 )
 
@@ -1,15 +1,18 @@
 import re
 from datetime import date, datetime, timedelta
 from enum import Enum
+from functools import lru_cache
+from pathlib import Path
 from typing import Annotated
 
 import duckdb
-import numpy as np
 import polars as pl
 import typer
 from rich.console import Console
 from tlds import tld_set
 
+from tai.database.connector import get_report_connection
+
 app = typer.Typer()
 
 console = Console()
@@ -22,32 +25,65 @@ PLAYERS_BLACKLIST = [
 ]
 
 
-def is_safe(text: str | None) -> bool:
-    """Checks if a string is safe based on a set of rules."""
-    if not text:
-        return True
+MENTION_PATTERN = re.compile(r'@[a-z0-9_]')
+DOMAIN_PATTERN = re.compile(r'(?:[a-z0-9-]+\.)+(?P<tld>[a-z0-9-]{2,})')
+TLDS = frozenset(tld_set)
 
-    processed_text = ''.join(text.lower().split())
 
-    if 'http://' in processed_text or 'https://' in processed_text:
-        return False
+@lru_cache(maxsize=4096)
+def is_safe(text: str | None) -> bool:
+    """Checks if a string is safe based on a set of rules.
 
-    if 't.me/' in processed_text:
-        return False
+    Results are cached, as the same player and world names come up in every digest the
+    service generates.
+    """
+    if not text:
+        return True
 
-    if re.search(r'@[a-zA-Z0-9_]+', processed_text):
+    # Most names are a single word, so the split and join are skipped when there's no
+    # whitespace to remove. The only printable whitespace character is the space itself
+    if ' ' not in text and text.isprintable():
+        processed_text = text.lower()
+    else:
+        processed_text = ''.join(text.lower().split())
+
+    # Plain substring checks are cheaper than a regex, so the link markers are checked first
+    if (
+        'http://' in processed_text
+        or 'https://' in processed_text
+        or 't.me/' in processed_text
+        or MENTION_PATTERN.search(processed_text)
+    ):
         return False
 
-    match = re.search(r'([a-z0-9-]{1,}\.){1,}[a-z0-9-]{2,}', processed_text)
-    if match:
-        potential_domain = match.group(0)
-        parts = potential_domain.split('.')
-        if parts[-1] in tld_set:
+    # Only the first domain-like match is checked against the known TLDs
+    if '.' in processed_text:
+        match = DOMAIN_PATTERN.search(processed_text)
+        if match and match.group('tld') in TLDS:
             return False
 
     return not ('rp' in processed_text and 'sex' in processed_text)
 
 
+# Matches the characters str.split() treats as whitespace, which are Unicode whitespace
+# plus the ASCII separators \x1c-\x1f
+WHITESPACE_PATTERN = r'[\s\x1c-\x1f]'
+
+
+def is_safe_expr(expr: pl.Expr) -> pl.Expr:
+    """Builds a native Polars expression that applies the is_safe rules to a column."""
+    text = expr.str.to_lowercase().str.replace_all(WHITESPACE_PATTERN, '')
+    # The last label of the first domain-like match, as in is_safe
+    tld = text.str.extract(DOMAIN_PATTERN.pattern, 1)
+    is_unsafe = (
+        text.str.contains_any(['http://', 'https://', 't.me/'])
+        | text.str.contains(MENTION_PATTERN.pattern)
+        | tld.is_in(TLDS).fill_null(False)
+        | (text.str.contains('rp', literal=True) & text.str.contains('sex', literal=True))
+    )
+    return is_unsafe.not_().fill_null(True)
+
+
 class Range(str, Enum):
     """Enumeration for the time range of the digest."""
 
@@ -57,48 +93,46 @@ class Range(str, Enum):
     year = 'year'
 
 
-month_names_ru_genitive = {
-    1: 'января',
-    2: 'февраля',
-    3: 'марта',
-    4: 'апреля',
-    5: 'мая',
-    6: 'июня',
-    7: 'июля',
-    8: 'августа',
-    9: 'сентября',
-    10: 'октября',
-    11: 'ноября',
-    12: 'декабря',
-}
-
-month_names_ru_nominative = {
-    1: 'январь',
-    2: 'февраль',
-    3: 'март',
-    4: 'апреля',
-    5: 'май',
-    6: 'июнь',
-    7: 'июль',
-    8: 'август',
-    9: 'сентября',
-    10: 'октября',
-    11: 'ноября',
-    12: 'декабрь',
-}
+# Indexed by month number minus one
+month_names_ru_genitive = (
+    'января',
+    'февраля',
+    'марта',
+    'апреля',
+    'мая',
+    'июня',
+    'июля',
+    'августа',
+    'сентября',
+    'октября',
+    'ноября',
+    'декабря',
+)
+
+month_names_ru_nominative = (
+    'январь',
+    'февраль',
+    'март',
+    'апрель',
+    'май',
+    'июнь',
+    'июль',
+    'август',
+    'сентябрь',
+    'октябрь',
+    'ноябрь',
+    'декабрь',
+)
 
 
 def format_date_ru(date_obj: date) -> str:
     """Formats a date object into 'day month_name' in Russian."""
     day = date_obj.day
-    month = month_names_ru_genitive[date_obj.month]
+    month = month_names_ru_genitive[date_obj.month - 1]
     return f'{day} {month}'
 
 
-def pluralize_players(count: int | None) -> str:
-    """Returns the correct plural form of the word 'игрок' in Russian."""
-    if count is None:
-        return 'игроков'
+def _players_plural_form(count: int) -> str:
     if count % 10 == 1 and count % 100 != 11:
         return 'игрок'
     elif 2 <= count % 10 <= 4 and (count % 100 < 10 or count % 100 >= 20):
@@ -107,6 +141,29 @@ def pluralize_players(count: int | None) -> str:
         return 'игроков'
 
 
+def _minutes_plural_form(minutes: int) -> str:
+    if minutes % 10 == 1 and minutes != 11:
+        return 'минута'
+    elif 1 < minutes % 10 < 5 and minutes not in [12, 13, 14]:
+        return 'минуты'
+    else:
+        return 'минут'
+
+
+# The plural forms only depend on the last two digits, and rounded durations always have
+# fewer than 60 minutes, so the forms are looked up instead of recomputed per call
+PLAYERS_PLURAL_FORMS = tuple(_players_plural_form(count) for count in range(100))
+HOURS_PLURAL_FORMS = ('часов', 'час', 'часа', 'часа', 'часа')
+MINUTES_PLURAL_FORMS = tuple(_minutes_plural_form(minutes) for minutes in range(60))
+
+
+def pluralize_players(count: int | None) -> str:
+    """Returns the correct plural form of the word 'игрок' in Russian."""
+    if count is None:
+        return 'игроков'
+    return PLAYERS_PLURAL_FORMS[count % 100]
+
+
 def format_duration_rounded(hours: float | None) -> str:
     """Formats duration in hours into a human-readable string in Russian."""
     if not hours or hours < 0:
@@ -124,17 +181,8 @@ def format_duration_rounded(hours: float | None) -> str:
     h = rounded_minutes // 60
     m = rounded_minutes % 60
 
-    hours_str = 'час'
-    if 1 < h < 5:
-        hours_str = 'часа'
-    elif h >= 5:
-        hours_str = 'часов'
-
-    minutes_str = 'минут'
-    if m % 10 == 1 and m != 11:
-        minutes_str = 'минута'
-    elif 1 < m % 10 < 5 and m not in [12, 13, 14]:
-        minutes_str = 'минуты'
+    hours_str = HOURS_PLURAL_FORMS[h] if h < 5 else 'часов'
+    minutes_str = MINUTES_PLURAL_FORMS[m]
 
     if m == 0:
         return f'{h} {hours_str}'
@@ -171,27 +219,31 @@ def get_most_active_players(
     top_n: int = 3,
 ):
     """Get the most active players by total session duration."""
-
-    query = """
+    # Blacklisted players and names with link markers, which is_safe always rejects, are
+    # dropped in the query. The remaining rows are checked in order until `top_n` pass
+    query = r"""
         SELECT
             player,
-            SUM(epoch(session_end) - epoch(session_start)) / 3600.0 AS total_duration_hours
+            SUM(epoch(session_end - session_start)) / 3600.0 AS total_duration_hours
         FROM db_sessions.sessions
-        WHERE session_start >= ? AND session_start < ?
+        WHERE session_start >= ? AND session_start < ? AND NOT list_contains(?::VARCHAR[], player)
         GROUP BY player
+        HAVING NOT regexp_matches(lower(player), 'https?://|t\.me/|@[a-z0-9_]')
         ORDER BY total_duration_hours DESC
     """
 
-    params = [start_date, end_date]
+    params = [start_date, end_date, PLAYERS_BLACKLIST]
 
-    df = con.execute(query, params).pl()
+    result = con.execute(query, params)
+    rows = []
+    while len(rows) < top_n and (batch := result.fetchmany(top_n)):
+        rows.extend(row for row in batch if is_safe(row[0]))
 
-    if PLAYERS_BLACKLIST:
-        df = df.filter(~pl.col('player').is_in(PLAYERS_BLACKLIST))
-
-    df = df.filter(pl.col('player').map_elements(is_safe, return_dtype=pl.Boolean))
-
-    return df.limit(top_n)
+    return pl.DataFrame(
+        rows[:top_n],
+        schema={'player': pl.String, 'total_duration_hours': pl.Float64},
+        orient='row',
+    )
 
 
 def get_most_popular_worlds(
@@ -201,49 +253,49 @@ def get_most_popular_worlds(
     top_n: int = 5,
 ):
     """Get the most popular worlds based on an area-under-curve (AUC) score."""
+    # The AUC is the trapezoidal area under the online curve (players minus one, floored at
+    # zero), starting from zero players at the session start.
+    # The collector only rewrites `session_end` of running world sessions every
+    # `update_interval` seconds (5 minutes by default) while no world connects or
+    # disconnects. For worlds still running when the digest is built, samples from up to
+    # that long before the report are outside the session and are not counted
     query = """
+        WITH samples AS (
+            SELECT
+                online.name,
+                online.players,
+                greatest(online.players - 1, 0) AS counted_players,
+                epoch(online.saved_at - sessions.session_start) / 3600.0 AS time_elapsed,
+                epoch(sessions.session_end - sessions.session_start) / 3600.0 AS session_length_hours
+            FROM db_worlds_online.worlds_online AS online
+            JOIN db_world_sessions.world_sessions AS sessions ON online.name = sessions.name AND online.saved_at BETWEEN sessions.session_start AND sessions.session_end
+            WHERE sessions.session_start >= ? AND sessions.session_start < ?
+        ),
+        trapezoids AS (
+            SELECT
+                name,
+                players,
+                time_elapsed,
+                session_length_hours,
+                (time_elapsed - COALESCE(LAG(time_elapsed) OVER w, 0))
+                    * (counted_players + COALESCE(LAG(counted_players) OVER w, 0)) / 2 AS area
+            FROM samples
+            WINDOW w AS (PARTITION BY name ORDER BY time_elapsed)
+        )
         SELECT
-            online.name,
-            online.players,
-            (epoch(online.saved_at) - epoch(sessions.session_start)) / 3600.0 AS time_elapsed,
-            (epoch(sessions.session_end) - epoch(sessions.session_start)) / 3600.0 AS session_length_hours
-        FROM db_worlds_online.worlds_online AS online
-        JOIN db_world_sessions.world_sessions AS sessions ON online.name = sessions.name AND online.saved_at BETWEEN sessions.session_start AND sessions.session_end
-        WHERE sessions.session_start >= ? AND sessions.session_start < ?
-        ORDER BY online.name, time_elapsed
+            name,
+            SUM(area) AS auc,
+            MAX(players) AS peak_players,
+            arg_min(session_length_hours, time_elapsed) AS session_length
+        FROM trapezoids
+        GROUP BY name
+        HAVING peak_players >= 5 AND auc >= 0.6 AND session_length >= 20 / 60.0
+        ORDER BY auc DESC
     """
-    df = con.execute(query, [start_date, end_date]).pl()
+    df = pl.from_arrow(con.execute(query, [start_date, end_date]).to_arrow_table())
     if df.height == 0:
         return pl.DataFrame()
-    return (
-        df.group_by('name')
-        .agg(
-            pl.col('players').alias('players_list'),
-            pl.col('time_elapsed').alias('time_elapsed_list'),
-            pl.col('players').max().alias('peak_players'),
-            pl.col('session_length_hours').first().alias('session_length'),
-        )
-        .with_columns(
-            pl.struct(['players_list', 'time_elapsed_list'])
-            .map_elements(
-                lambda s: np.trapezoid(
-                    y=[0] + [max(0, y - 1) for y in s['players_list']],
-                    x=[0] + s['time_elapsed_list'],
-                ),
-                return_dtype=pl.Float64,
-            )
-            .alias('auc')
-        )
-        .select('name', 'auc', 'peak_players', 'session_length')
-        .filter(
-            (pl.col('peak_players') >= 5)
-            & (pl.col('auc') >= 0.6)
-            & (pl.col('session_length') >= (20 / 60.0))
-        )
-        .filter(pl.col('name').map_elements(is_safe, return_dtype=pl.Boolean))
-        .sort('auc', descending=True)
-        .limit(top_n)
-    )
+    return df.filter(is_safe_expr(pl.col('name'))).limit(top_n)
 
 
 def get_peak_server_online(con: duckdb.DuckDBPyConnection, start_date: date, end_date: date):
@@ -258,7 +310,7 @@ def get_digest_data(
     end_date: date,
 ) -> tuple[pl.DataFrame, pl.DataFrame, int | None]:
     """Fetches digest data from the database."""
-    with duckdb.connect() as con:
+    with get_report_connection() as con:
         con.execute("ATTACH 'data/sessions.db' AS db_sessions (READ_ONLY)")
         con.execute("ATTACH 'data/worlds_online.db' AS db_worlds_online (READ_ONLY)")
         con.execute("ATTACH 'data/world_sessions.db' AS db_world_sessions (READ_ONLY)")
@@ -271,6 +323,27 @@ def get_digest_data(
         return active_players_df, popular_worlds_df, peak_online
 
 
+DIGEST_CACHE_DIR = Path('data/digest_cache')
+
+MEDAL_EMOJIS = ('🥇 ', '🥈 ', '🥉 ')
+PLAYER_LINE_TEMPLATE = '{emoji}`{name}`: {duration} часов'
+WORLD_LINE_TEMPLATE = '\n{emoji}`{name}`\n  👥 Пик: {peak_players} {players_plural}\n  ⏳ Длительность: {session_length}'
+
+
+def _is_hot_world(
+    peak_players: int | None, session_length: float | None, auc: float | None
+) -> bool:
+    """Checks if a world was busy and long-lived enough to be marked as hot."""
+    return bool(
+        peak_players
+        and session_length
+        and auc
+        and peak_players >= 8
+        and session_length >= 1.5
+        and auc >= 5.8
+    )
+
+
 def render_digest_report(
     range_enum: Range,
     start_date: date,
@@ -285,51 +358,51 @@ def render_digest_report(
     elif range_enum == Range.week:
         title = f'**Дайджест за неделю ({format_date_ru(start_date)} - {format_date_ru(end_date - timedelta(days=1))})**'
     elif range_enum == Range.month:
-        title = f'**Дайджест за {month_names_ru_nominative[start_date.month]}**'
+        title = f'**Дайджест за {month_names_ru_nominative[start_date.month - 1]}**'
     elif range_enum == Range.year:
         title = f'**Дайджест за {start_date.year} год**'
 
-    report = [title]
-
-    report.append('\n**🏆 Самые активные игроки**')
+    report = [title, '\n**🏆 Самые активные игроки**']
     if not active_players_df.is_empty():
-        for i, row in enumerate(active_players_df.iter_rows(named=True)):
-            player_name = row['player']
-            duration = round(row['total_duration_hours'], 1)
-            emoji = ''
-            if i == 0:
-                emoji = '🥇 '
-            elif i == 1:
-                emoji = '🥈 '
-            elif i == 2:
-                emoji = '🥉 '
-            report.append(f'{emoji}`{player_name}`: {duration} часов')
+        report.extend(
+            PLAYER_LINE_TEMPLATE.format_map(
+                {
+                    'emoji': MEDAL_EMOJIS[i] if i < len(MEDAL_EMOJIS) else '',
+                    'name': player_name,
+                    'duration': round(duration_hours, 1),
+                }
+            )
+            for i, (player_name, duration_hours) in enumerate(
+                zip(
+                    active_players_df['player'].to_list(),
+                    active_players_df['total_duration_hours'].to_list(),
+                    strict=True,
+                )
+            )
+        )
     else:
         report.append('Нет данных.')
 
     report.append('\n**🌍 Самые популярные миры**')
     if not popular_worlds_df.is_empty():
-        for row in popular_worlds_df.iter_rows(named=True):
-            world_name = row['name']
-            peak_players = row['peak_players']
-            session_length = row['session_length']
-            auc = row['auc']
-
-            emoji = ''
-            if (
-                peak_players
-                and session_length
-                and auc
-                and peak_players >= 8
-                and session_length >= 1.5
-                and auc >= 5.8
-            ):
-                emoji = '🔥 '
-
-            formatted_session_length = format_duration_rounded(session_length)
-            report.append(
-                f'\n{emoji}`{world_name}`\n  👥 Пик: {peak_players} {pluralize_players(peak_players)}\n  ⏳ Длительность: {formatted_session_length}'
+        report.extend(
+            WORLD_LINE_TEMPLATE.format_map(
+                {
+                    'emoji': '🔥 ' if _is_hot_world(peak_players, session_length, auc) else '',
+                    'name': world_name,
+                    'peak_players': peak_players,
+                    'players_plural': pluralize_players(peak_players),
+                    'session_length': format_duration_rounded(session_length),
+                }
+            )
+            for world_name, peak_players, session_length, auc in zip(
+                popular_worlds_df['name'].to_list(),
+                popular_worlds_df['peak_players'].to_list(),
+                popular_worlds_df['session_length'].to_list(),
+                popular_worlds_df['auc'].to_list(),
+                strict=True,
             )
+        )
     else:
         report.append('Нет данных.')
 
@@ -338,6 +411,27 @@ def render_digest_report(
     return '\n'.join(report)
 
 
+def get_cached_digest_report(range_enum: Range, start_date: date, end_date: date) -> str:
+    """Renders the digest report, reusing a cached copy for ranges that are over."""
+    cache_path = (
+        DIGEST_CACHE_DIR
+        / f'{range_enum.value}-{start_date.isoformat()}-{end_date.isoformat()}.md'
+    )
+    # Sessions that started in the range may still be running on the day it ends, so a
+    # report is only final once a full day has passed since then
+    is_final = end_date < date.today()
+    if is_final and cache_path.exists():
+        return cache_path.read_text(encoding='utf-8')
+
+    report = render_digest_report(
+        range_enum, start_date, end_date, get_digest_data(start_date, end_date)
+    )
+    if is_final:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(report, encoding='utf-8')
+    return report
+
+
 @app.command()
 def main(
     range_enum: Annotated[Range, typer.Option(help='Time range for the digest.')] = Range.day,
@@ -350,8 +444,7 @@ def main(
     start, end = get_date_range(range_enum, start_date_str)
 
     try:
-        data = get_digest_data(start, end)
-        report = render_digest_report(range_enum, start, end, data)
+        report = get_cached_digest_report(range_enum, start, end)
         console.print(report)
 
     except duckdb.IOException as e:
@@ -15,6 +15,13 @@ class Settings(BaseSettings):
     training_port: int = 7777
 
     training_api_base_url: str = 'https://training-server.com/api'
+    training_api_concurrency: int = 8
+    training_api_rate_limit_rps: float = 1.25
+
+    duckdb_threads: int | None = None
+    duckdb_memory_limit: str = '2GB'
+    duckdb_checkpoint_threshold: str = '64MB'
+    duckdb_temp_directory: str | None = None
 
     chrono_login: str
     chrono_token: str
@@ -22,7 +29,8 @@ class Settings(BaseSettings):
 
     telegram_bot_token: str
     telegram_channel_id: str
-    telegram_bot_id: str
+    # Unused, kept so .env files that still set it load, as extra keys are rejected
+    telegram_bot_id: str | None = None
 
 
 settings = Settings()
@@ -5,11 +5,14 @@ Handles formatting and sending messages to the Telegram API
 using 'aiogram' (for trio compatibility) and 'telegramify-markdown'.
 """
 
+from typing import Any
+
 import telegramify_markdown
 import trio
 import trio_asyncio
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramAPIError
 
@@ -19,19 +22,43 @@ from tai.settings import settings
 # This bot instance will be initialized in main()
 _bot: Bot | None = None
 
+# telegramify_markdown outputs MarkdownV2, so it's the default parse mode for every message
+DEFAULT_BOT_PROPERTIES = DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
+
+# Delays in seconds before each retry of a failed send, doubling from 2 seconds
+RETRY_DELAYS = (2, 4, 8, 16, 32)
+
+# Idle connections are kept open for longer than the longest retry delay, so retries
+# reuse the connection instead of repeating the TCP and TLS handshakes
+KEEPALIVE_TIMEOUT = RETRY_DELAYS[-1] + 30
+
+
+class KeepAliveAiohttpSession(AiohttpSession):
+    """An aiogram session whose connector keeps idle connections for KEEPALIVE_TIMEOUT."""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # AiohttpSession has no keep-alive option, but builds its TCPConnector from these
+        # arguments. Checked against aiogram 3.31, which sets them in __init__
+        self._connector_init['keepalive_timeout'] = KEEPALIVE_TIMEOUT
+
 
 async def init_telegram_bot():
     """
     Initializes the global Bot instance.
 
-    Must be called once before send_telegram_message.
+    Must be called before sending any messages. Does nothing if the bot is
+    already initialized, so its session is never replaced and leaked.
     """
     global _bot
+    if _bot is not None:
+        return
     # The user stated that telegram_bot_token is always present, so no check needed here.
-
-    # Set the default parse mode to MARKDOWN_V2, as that's what telegramify_markdown outputs
-    properties = DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
-    _bot = Bot(token=settings.telegram_bot_token, default=properties)
+    _bot = Bot(
+        token=settings.telegram_bot_token,
+        session=KeepAliveAiohttpSession(),
+        default=DEFAULT_BOT_PROPERTIES,
+    )
 
     try:
         # Test the connection and get bot info
@@ -39,7 +66,8 @@ async def init_telegram_bot():
         log.info('telegram_bot_initialized_successfully')
     except TelegramAPIError as e:
         log.error('telegram_bot_init_failed', error=e.message)
-        _bot = None  # Reset on failure
+        # Close the session before resetting, so a retried init doesn't leak it
+        await shutdown_telegram_bot()
         raise  # Raise the exception as requested by the user
 
 
@@ -55,14 +83,30 @@ async def shutdown_telegram_bot():
         _bot = None
 
 
-async def send_telegram_message(message_text: str, channel_id: str, send_as: str | None = None):
+async def _wait_before_retry(
+    retry_attempt: int, event: str, error: object, channel_id: str
+) -> None:
+    """Logs a failed send attempt and sleeps for its retry delay."""
+    delay = RETRY_DELAYS[retry_attempt - 1]
+    log.warning(
+        event,
+        retry=retry_attempt,
+        of=len(RETRY_DELAYS),
+        waiting_for=delay,
+        error=error,
+        channel_id=channel_id,
+    )
+    await trio.sleep(delay)
+
+
+async def send_prepared_message(formatted_text: str, channel_id: str):
     """
-    Sends a message to a specified Telegram channel.
+    Sends an already formatted MarkdownV2 message to a specified Telegram channel.
 
-    The message is automatically converted from standard Markdown to
-    Telegram-compatible MarkdownV2.
+    Use this to send the same report to several channels without converting it
+    from Markdown again for each of them.
 
-    :param message_text: The raw text (with standard markdown) to send.
+    :param formatted_text: The text in Telegram-compatible MarkdownV2.
     :param channel_id: The target channel ID.
     """
     if _bot is None:
@@ -70,12 +114,7 @@ async def send_telegram_message(message_text: str, channel_id: str, send_as: str
         # As per user instruction, raise an error if bot is not initialized
         raise RuntimeError('Telegram bot is not initialized.')
 
-    max_retry_attempts = 5
-    initial_retry_delay = 2  # Start with a 2-second delay
-
-    formatted_text = telegramify_markdown.markdownify(message_text)
-
-    for retry_attempt in range(1, max_retry_attempts + 1):
+    for retry_attempt in range(1, len(RETRY_DELAYS) + 1):
         try:
             await trio_asyncio.aio_as_trio(
                 _bot.send_message(
@@ -87,28 +126,27 @@ async def send_telegram_message(message_text: str, channel_id: str, send_as: str
             log.info('telegram_message_sent_successfully', channel_id=channel_id)
             return  # Message sent, exit retry loop
         except TelegramAPIError as e:
-            delay = initial_retry_delay * (2 ** (retry_attempt - 1))
-            log.warning(
-                'telegram_send_failed_api_error',
-                retry=retry_attempt,
-                of=max_retry_attempts,
-                waiting_for=delay,
-                error=e.message,
-                channel_id=channel_id,
+            await _wait_before_retry(
+                retry_attempt, 'telegram_send_failed_api_error', e.message, channel_id
             )
-            await trio.sleep(delay)
         except Exception as e:
-            delay = initial_retry_delay * (2 ** (retry_attempt - 1))
-            log.warning(
-                'telegram_send_failed_unknown_error',
-                retry=retry_attempt,
-                of=max_retry_attempts,
-                waiting_for=delay,
-                error=e,
-                channel_id=channel_id,
+            await _wait_before_retry(
+                retry_attempt, 'telegram_send_failed_unknown_error', e, channel_id
             )
-            await trio.sleep(delay)
 
     # If all retries fail, raise an exception
-    msg = f'Failed to send Telegram message after {max_retry_attempts} attempts.'
+    msg = f'Failed to send Telegram message after {len(RETRY_DELAYS)} attempts.'
     raise RuntimeError(msg)
+
+
+async def send_telegram_message(message_text: str, channel_id: str):
+    """
+    Sends a message to a specified Telegram channel.
+
+    The message is automatically converted from standard Markdown to
+    Telegram-compatible MarkdownV2.
+
+    :param message_text: The raw text (with standard markdown) to send.
+    :param channel_id: The target channel ID.
+    """
+    await send_prepared_message(telegramify_markdown.markdownify(message_text), channel_id)